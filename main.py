@@ -1,13 +1,49 @@
-from fastapi import FastAPI, HTTPException, Query
+import asyncio
+from bisect import bisect_right
+from contextlib import asynccontextmanager
+from cachetools import TTLCache
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware 
+from fastapi.responses import Response
 import httpx
+import logging
+import orjson
 from pydantic import BaseModel
 from typing import Optional
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+logger = logging.getLogger(__name__)
+
+# One shared client for the whole app so connections to Open-Meteo stay alive
+# between requests instead of doing a new TCP/TLS handshake every time
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.http = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60),
+        # Fail fast on a slow upstream instead of tying up the worker
+        timeout=httpx.Timeout(connect=2.0, read=4.0, write=2.0, pool=2.0),
+        http2=True,
+    )
+
+    # Open the connections to both hosts now so the first real request
+    # doesn't pay for the handshakes. If Meteo is unreachable we start anyway
+    await asyncio.gather(
+        app.state.http.get(GEO_URL, params={"name": "Berlin", "count": 1}),
+        app.state.http.get(WEATHER_URL, params={"latitude": 52.52, "longitude": 13.41, "current": "temperature_2m"}),
+        return_exceptions=True,
+    )
+    yield
+    await app.state.http.aclose()
+
 app = FastAPI(
     title="Travel Condition API",
     description="A RESTful API that intelligently resolves city ambiguity to recommend travel.",
     version="1.1.0",
+    lifespan=lifespan,
 )
 # Add CORS Middleware
 origins = [
@@ -33,128 +69,253 @@ class Recommendation(BaseModel):
     state: Optional[str]
     score: int
     score_verdict: str
+    temp_verdict: str
+    wind_verdict: str
+    rain_verdict: str
     details: Weather
 
 # --- LOGIC ALGORITHM ---
-def get_score(temp: float, wind: float, rain: float) -> dict:
-    score = 100
-    score_verdict = "Perfect"
-
-    # Temperature Logic with swaying score from ideal temp
-    ideal_temp = 25
-    diff = abs(temp - ideal_temp)
-    score -= (diff * 2.0)
-    if temp < -5: score_verdict = "Dangerously Cold"
-    elif temp < 0: score_verdict = "Freezing"
-    elif temp < 5: score_verdict = "Very Cold"
-    elif temp < 10: score_verdict = "Cold"
-    elif temp < 16: score_verdict = "Chilly"
-    elif temp < 26: score_verdict = "Perfect"
-    elif temp < 30: score_verdict = "Warm"
-    elif temp < 35: score_verdict = "Hot"
-    elif temp < 40: score_verdict = "Very Hot"
-    else: score_verdict = "Dangerously Hot"
-
-    # Wind Logic with swaying score from ideal wind speed
-    ideal_wind = 0
-    diff = abs(wind - ideal_wind)
-    score -= (diff * 0.5)
-    if wind < 5: score_verdict += " & Calm"
-    elif wind < 12: score_verdict += " & Light Breeze"
-    elif wind < 20: score_verdict += " & Breezy"
-    elif wind < 30: score_verdict += " & Windy"
-    elif wind < 50: score_verdict += " & Strong Winds"
-    else: score_verdict += " & Stormy"
-
-    # Rain Logic with swaying score from ideal rain amount
-    ideal_rain = 0
-    diff = abs(rain - ideal_rain)
-    score -= (diff * 4.0)
-    if rain == 0: score_verdict += " & Dry"
-    elif rain < 2.5: score_verdict += " & Light Rain"
-    elif rain < 7.6: score_verdict += " & Rain"
-    elif rain < 50: score_verdict += " & Heavy Rain"
-    else: score_verdict += " & Flooding"
+# Verdict bands, each edge is the exclusive upper bound of the verdict at the same index
+TEMP_EDGES = (-5, 0, 5, 10, 16, 26, 30, 35, 40)
+TEMP_VERDICTS = ("Dangerously Cold", "Freezing", "Very Cold", "Cold", "Chilly",
+                 "Perfect", "Warm", "Hot", "Very Hot", "Dangerously Hot")
+WIND_EDGES = (5, 12, 20, 30, 50)
+WIND_VERDICTS = ("Calm", "Light Breeze", "Breezy", "Windy", "Strong Winds", "Stormy")
+# No rain at all is its own "Dry" verdict (index 0), the edges start after it
+RAIN_EDGES = (2.5, 7.6, 50.0)
+RAIN_VERDICTS = ("Dry", "Light Rain", "Rain", "Heavy Rain", "Flooding")
+
+def _score_bisect(temp: float, wind: float, rain: float) -> tuple:
+    # Swaying score from ideal temp (25), wind (0) and rain (0)
+    score = 100 - abs(temp - 25) * 2.0 - abs(wind) * 0.5 - abs(rain) * 4.0
+
+    t_idx = bisect_right(TEMP_EDGES, temp)
+    w_idx = bisect_right(WIND_EDGES, wind)
+    r_idx = 0 if rain == 0 else 1 + bisect_right(RAIN_EDGES, rain)
 
     # Ensures the score is int 0 and not a negative
-    return {"score": max(0, int(score)), "score_verdict": score_verdict}
+    return max(0, int(score)), t_idx, w_idx, r_idx
 
-# --- ENDPOINT ---
-@app.get("/recommend-trip", response_model=Recommendation)
-async def recommend_trip(
-    country_code: str = Query(..., min_length=2, max_length=2, description="ISO Country code (e.g. US, GB, CA)"),
-    city: str = Query(..., description="City name (e.g. Warwick)"),
-    state: Optional[str] = Query(None, description="State (e.g. Rhode Island, New York)"),
-):
-    async with httpx.AsyncClient() as client:
-
-        # Mateo requires lat/long so we use geocoding to map it
-        # FETCH first 10 results
-        geo_url = "https://geocoding-api.open-meteo.com/v1/search"
-        geo_params = {
-            "name": city, 
-            "count": 10,  
-            "language": "en", 
-            "format": "json"
-        }
+def _score_branchless(temp: float, wind: float, rain: float) -> tuple:
+    # Same math as _score_bisect, written so numba can compile it to plain native code
+    score = 100 - abs(temp - 25) * 2.0 - abs(wind) * 0.5 - abs(rain) * 4.0
 
-        try:
-            geo_resp = await client.get(geo_url, params=geo_params)
-            geo_resp.raise_for_status()
-            geo_data = geo_resp.json()
-        except httpx.RequestError:
-            raise HTTPException(status_code=503, detail="Geocoding API is down")
-
-        if not geo_data.get("results"):
-            raise HTTPException(status_code=404, detail="City could not be found")
-
-        # Get the best match from the fetch list
-        selected_location = None
-        candidates = geo_data["results"]
-
-        for candidate in candidates:
-            if country_code and candidate.get("country_code", "").upper() != country_code.upper():
-                continue
-
-            # If user provided state, skip if it doesn't match
-            # Meteo stores states in "admin1"
-            if state:
-                admin1 = candidate.get("admin1", "").lower()
-                if state.lower() not in admin1: 
-                    continue
-
-            # If we passed the checks (or no checks were needed), we found our city
-            selected_location = candidate
-            break # Stop the looping
-
-        # If we filtered everything out and found nothing:
-        if not selected_location:
-             raise HTTPException(status_code=404, detail=f"Could not find {city} in {state or 'any state'}, {country_code or 'any country'}")
-
-        # Extract location data from the searched location
-        lat = selected_location["latitude"]
-        lon = selected_location["longitude"]
-        resolved_country = selected_location.get("country", "Unknown")
-        resolved_state = selected_location.get("admin1", "Unknown") 
-        resolved_name = selected_location["name"]
-
-        #-- Fetches weather conditions
-        weather_url = "https://api.open-meteo.com/v1/forecast"
-        weather_params = {
-            "latitude": lat,
-            "longitude": lon,
-            "current": "temperature_2m,rain,wind_speed_10m",
-        }
+    t_idx = 0
+    for edge in TEMP_EDGES:
+        t_idx += temp >= edge
+    w_idx = 0
+    for edge in WIND_EDGES:
+        w_idx += wind >= edge
+    r_idx = 0
+    if rain != 0:
+        r_idx = 1
+        for edge in RAIN_EDGES:
+            r_idx += rain >= edge
+
+    return max(0, int(score)), t_idx, w_idx, r_idx
+
+# numba is optional, without it we fall back to the bisect version
+if njit is not None:
+    _score_numeric = njit(cache=True)(_score_branchless)
+    _score_numeric(25.0, 0.0, 0.0)  # Compile at import instead of on the first request
+else:
+    _score_numeric = _score_bisect
+
+def get_score(temp: float, wind: float, rain: float) -> dict:
+    score, t_idx, w_idx, r_idx = _score_numeric(float(temp), float(wind), float(rain))
+    t = TEMP_VERDICTS[t_idx]
+    w = WIND_VERDICTS[w_idx]
+    r = RAIN_VERDICTS[r_idx]
+    # score_verdict is kept joined for older clients, new ones can use the parts
+    return {
+        "score": score,
+        "score_verdict": f"{t} & {w} & {r}",
+        "temp_verdict": t,
+        "wind_verdict": w,
+        "rain_verdict": r,
+    }
+
+# --- UPSTREAM CALLS ---
+GEO_URL = "https://geocoding-api.open-meteo.com/v1/search"
+WEATHER_URL = "https://api.open-meteo.com/v1/forecast"
+
+# Last (etag, parsed body) per upstream query. Must outlive GEO_CACHE and
+# WEATHER_CACHE (longer TTL, room for both) so an expired entry can still be
+# revalidated with a 304 instead of downloaded again. Geocoding can take two
+# queries per key (the small page and the count=10 fallback)
+ETAG_CACHE = TTLCache(maxsize=2 * 10_000 + 50_000, ttl=7 * 86400)
+
+# Caps how many calls we have out to Meteo at once, and how long a call may
+# wait for a free slot. Timeouts and bad upstream statuses are all
+# httpx.HTTPError, which the callers turn into a 503
+OUTBOUND_SEM = asyncio.Semaphore(50)
+OUTBOUND_WAIT = 2.0
+
+async def _get_json(client: httpx.AsyncClient, url: str, params: dict) -> dict:
+    key = (url, tuple(params.items()))
+    cached = ETAG_CACHE.get(key)
+    headers = {"if-none-match": cached[0]} if cached else None
+
+    try:
+        await asyncio.wait_for(OUTBOUND_SEM.acquire(), OUTBOUND_WAIT)
+    except asyncio.TimeoutError:
+        raise httpx.PoolTimeout("Too many upstream calls in flight")
+    try:
+        resp = await client.get(url, params=params, headers=headers)
+    finally:
+        OUTBOUND_SEM.release()
+    if resp.status_code == 304 and cached:
+        return cached[1]
+    resp.raise_for_status()
+    data = orjson.loads(resp.content)
+
+    etag = resp.headers.get("etag")
+    if etag:
+        ETAG_CACHE[key] = (etag, data)
+    return data
+
+async def _geocode(client: httpx.AsyncClient, city: str, count: int) -> list:
+    # Mateo requires lat/long so we use geocoding to map it
+    # FETCH first `count` results
+    geo_params = {
+        "name": city, 
+        "count": count,  
+        "language": "en", 
+        "format": "json"
+    }
+
+    try:
+        geo_data = await _get_json(client, GEO_URL, geo_params)
+    except httpx.HTTPError:
+        raise HTTPException(status_code=503, detail="Geocoding API is down")
+
+    if not geo_data.get("results"):
+        raise HTTPException(status_code=404, detail="City could not be found")
+
+    return geo_data["results"]
+
+async def _weather(client: httpx.AsyncClient, lat: float, lon: float) -> dict:
+    #-- Fetches weather conditions
+    weather_params = {
+        "latitude": lat,
+        "longitude": lon,
+        "current": "temperature_2m,rain,wind_speed_10m",
+    }
+
+    try:
+        weather_data = await _get_json(client, WEATHER_URL, weather_params)
+    except httpx.HTTPError:
+        raise HTTPException(status_code=503, detail="Weather service unavailable")
 
+    return weather_data.get("current", {})
+
+# --- CACHING ---
+# City -> location lookups basically never change, so keep them for a day
+# No lock per key here: INFLIGHT below already coalesces requests with the same key
+GEO_CACHE = TTLCache(maxsize=10_000, ttl=86400)
+# Keys where no candidate matched the filters. Remembered for an hour so a
+# repeated miss doesn't pay for both geocoding calls (small page + count=10) again
+GEO_MISSES = TTLCache(maxsize=10_000, ttl=3600)
+# Open-Meteo only refreshes current conditions every ~15 min, 5 min is plenty fresh
+WEATHER_CACHE = TTLCache(maxsize=50_000, ttl=300)
+# key -> [lock, number of coroutines holding or waiting on it]
+WEATHER_LOCKS: dict = {}
+
+async def _cached(cache: TTLCache, locks: dict, key: tuple, fetch):
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    # Only one coroutine fetches a missing key, the others wait and read the cache
+    # (or retry under the same lock if the fetch failed). The lock is dropped once
+    # the last user is done, so failed keys don't pile up during an outage
+    entry = locks.get(key)
+    if entry is None:
+        entry = locks[key] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            value = cache.get(key)
+            if value is None:
+                value = await fetch()
+                cache[key] = value
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del locks[key]
+    return value
+
+# No candidate matched the country/state filters. The 404 message is built
+# per request in recommend_trip, since coalesced callers may spell the city differently
+class LocationNotFound(Exception):
+    pass
+
+def _match_location(candidates: list, cc: str, st: Optional[str]) -> Optional[dict]:
+    # Get the best match from the fetch list
+    # Meteo stores states in "admin1"
+    return next(
+        (
+            c for c in candidates
+            if c.get("country_code", "").upper() == cc
+            and (st is None or st in c.get("admin1", "").lower())
+        ),
+        None,
+    )
+
+async def _resolve_location(client: httpx.AsyncClient, city: str, st: Optional[str], cc: str) -> dict:
+    # Usually the top result is the one we want, so only ask for a few.
+    # If none of them match and the page was full, retry with the full 10
+    count = 5 if st else 1
+    candidates = await _geocode(client, city, count)
+    selected_location = _match_location(candidates, cc, st)
+    if not selected_location and len(candidates) >= count:
+        candidates = await _geocode(client, city, 10)
+        selected_location = _match_location(candidates, cc, st)
+
+    # If we filtered everything out and found nothing:
+    if not selected_location:
+         raise LocationNotFound()
+
+    # Only keep what the endpoint actually uses
+    return {
+        "latitude": selected_location["latitude"],
+        "longitude": selected_location["longitude"],
+        "country": selected_location.get("country", "Unknown"),
+        "admin1": selected_location.get("admin1", "Unknown"),
+        "name": selected_location["name"],
+    }
+
+# Requests currently being built, so identical concurrent requests share one result
+INFLIGHT: dict = {}
+
+async def _build_recommendation(client: httpx.AsyncClient, key: tuple) -> bytes:
+    selected_location = GEO_CACHE.get(key)
+    if selected_location is None:
+        if GEO_MISSES.get(key):
+            raise LocationNotFound()
+        city, st, cc = key
         try:
-            weather_resp = await client.get(weather_url, params=weather_params)
-            weather_resp.raise_for_status()
-            weather_data = weather_resp.json()
-        except httpx.RequestError:
-            raise HTTPException(status_code=503, detail="Weather service unavailable")
+            selected_location = await _resolve_location(client, city, st or None, cc)
+        except LocationNotFound:
+            GEO_MISSES[key] = True
+            raise
+        GEO_CACHE[key] = selected_location
+
+    # Meteo's weather is gridded anyway, so rounding to ~1 km lets nearby
+    # cities share one cached response (and one upstream URL)
+    lat_q = round(selected_location["latitude"], 2)
+    lon_q = round(selected_location["longitude"], 2)
+    current = await _cached(
+        WEATHER_CACHE, WEATHER_LOCKS, (lat_q, lon_q),
+        lambda: _weather(client, lat_q, lon_q),
+    )
+
+    # Extract location data from the searched location
+    resolved_country = selected_location["country"]
+    resolved_state = selected_location["admin1"]
+    resolved_name = selected_location["name"]
 
     # Extract data
-    current = weather_data.get("current", {})
     temp = current.get("temperature_2m", 0)
     rain = current.get("rain", 0)
     wind = current.get("wind_speed_10m", 0)
@@ -162,15 +323,86 @@ async def recommend_trip(
     # Run Algorithm
     analysis = get_score(temp, wind, rain)
 
-    return {
+    # Encoded once here so coalesced requests all reuse the same bytes.
+    # Key order matches the Recommendation model
+    return orjson.dumps({
+        "country": resolved_country,
         "city": resolved_name,
         "state": resolved_state,
-        "country": resolved_country,
         "score": analysis["score"],
         "score_verdict": analysis["score_verdict"],
+        "temp_verdict": analysis["temp_verdict"],
+        "wind_verdict": analysis["wind_verdict"],
+        "rain_verdict": analysis["rain_verdict"],
         "details": {
-            "temperature_c": temp,
+            "temperature_c": float(temp),
             "condition": "Raining" if rain > 0 else "Clear",
-            "wind_speed": wind,
+            "wind_speed": float(wind),
         },
-    }
\ No newline at end of file
+    })
+
+async def _shared_recommendation(client: httpx.AsyncClient, key: tuple):
+    # Errors come back as (status, detail) values instead of being raised, so each
+    # coalesced caller builds its own response. detail is None for LocationNotFound
+    try:
+        return await _build_recommendation(client, key)
+    except LocationNotFound:
+        return 404, None
+    except HTTPException as exc:
+        return exc.status_code, exc.detail
+    except Exception:
+        # e.g. a non-JSON 200 or a result missing fields from Meteo
+        logger.exception("Failed to build recommendation for %s", key)
+        return 503, "Unexpected response from upstream"
+
+# Error bodies for the fixed messages, pre-encoded so misses (unknown cities,
+# upstream down) skip FastAPI's exception handler and JSON encoding
+ERROR_BODIES = {
+    detail: orjson.dumps({"detail": detail})
+    for detail in (
+        "City could not be found",
+        "Geocoding API is down",
+        "Weather service unavailable",
+        "Unexpected response from upstream",
+    )
+}
+
+def _error_response(status_code: int, detail: str) -> Response:
+    body = ERROR_BODIES.get(detail) or orjson.dumps({"detail": detail})
+    return Response(content=body, status_code=status_code, media_type="application/json")
+
+# --- ENDPOINT ---
+# We build the JSON ourselves, the model is only kept for the docs so
+# FastAPI doesn't re-validate and re-serialize every response
+@app.get("/recommend-trip", response_model=None, responses={200: {"model": Recommendation}})
+async def recommend_trip(
+    request: Request,
+    country_code: str = Query(..., min_length=2, max_length=2, description="ISO Country code (e.g. US, GB, CA)"),
+    city: str = Query(..., description="City name (e.g. Warwick)"),
+    state: Optional[str] = Query(None, description="State (e.g. Rhode Island, New York)"),
+):
+    # Normalized once, the cache key and the candidate filter both use these
+    key = (city.strip().lower(), (state or "").strip().lower(), country_code.upper())
+
+    # First request for a key does the work, the rest just await the same task.
+    # shield() keeps a disconnecting client from cancelling it for everyone else
+    task = INFLIGHT.get(key)
+    if task is None:
+        client = request.app.state.http
+        task = asyncio.create_task(_shared_recommendation(client, key))
+        INFLIGHT[key] = task
+        task.add_done_callback(lambda _: INFLIGHT.pop(key, None))
+
+    result = await asyncio.shield(task)
+    if isinstance(result, bytes):
+        return Response(content=result, media_type="application/json")
+
+    status_code, detail = result
+    if detail is None:
+        detail = f"Could not find {city} in {state or 'any state'}, {country_code}"
+    return _error_response(status_code, detail)
+
+if __name__ == "__main__":
+    import uvicorn
+    # uvicorn picks uvloop/httptools on its own when they're installed
+    uvicorn.run("main:app", host="127.0.0.1", port=8000)